@@ -7,17 +7,86 @@ miscellaneous aws utilities
 NOTE: This is a set of functions not a class
 """
 import logging
-import pandas as pd
-import boto3
 import json
+import heapq
 import itertools
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
+from time import time
 
 log = logging.getLogger(__name__)
 
-ec2 = boto3.resource("ec2")
-client = boto3.client("ec2")
+# registry of boto3 objects created on first use. boto3 and heavy dependencies are imported when needed.
+# profile => session
+sessions = dict()
+# (service, region, profile) => client. clients are thread safe so shared by threads.
+clients = dict()
+# (region, profile) => ec2 resource for each thread. resources are not thread safe.
+resources = threading.local()
+lock = threading.RLock()
+
+
+def __getattr__(name):
+    """ aws.ec2 and aws.client are the default resource and client """
+    if name == "ec2":
+        return get_ec2()
+    if name == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__} has no attribute {name}")
+
+
+def get_session(profile=None):
+    """ return shared session for profile. default profile is the configured profile. api calls can be traced. """
+    import boto3
+    from . import trace
+
+    with lock:
+        try:
+            return sessions[profile]
+        except KeyError:
+            session = boto3.session.Session(profile_name=profile)
+            trace.register(session.events)
+            sessions[profile] = session
+            return session
+
+
+def get_client(service="ec2", region=None, profile=None):
+    """ return shared client for service and region. default region is the configured region """
+    with lock:
+        session = get_session(profile)
+        region = region or session.region_name
+        try:
+            return clients[(service, region, profile)]
+        except KeyError:
+            c = session.client(service, region)
+            clients[(service, region, profile)] = c
+            return c
+
+
+def get_ec2(region=None, profile=None):
+    """ return ec2 resource for the current thread. uses the shared client. """
+    try:
+        cache = resources.cache
+    except AttributeError:
+        cache = resources.cache = dict()
+    try:
+        return cache[(region, profile)]
+    except KeyError:
+        pass
+    with lock:
+        res = get_session(profile).resource("ec2", region)
+    res.meta.client = get_client("ec2", region, profile)
+    cache[(region, profile)] = res
+    return res
+
+
+def get_regions():
+    """ return list of regions enabled for the account """
+    return [r["RegionName"] for r in get_client().describe_regions()["Regions"]]
+
 
 # pythonic filters ###########################################
 
@@ -45,43 +114,147 @@ def tfilt(**kwargs):
     return filt(**{f"tag:{k.replace('_', '-')}": v for k, v in kwargs.items()})
 
 
-# get filtered lists of resources sorted by date ###############################
+# fields of each resource type that are native ec2 filters. other keys are tags.
+FIELDS = dict(
+    instances=dict(
+        state="instance-state-name",
+        instance_id="instance-id",
+        instance_type="instance-type",
+        image_id="image-id",
+        availability_zone="availability-zone",
+    ),
+    images=dict(state="state", image_id="image-id", architecture="architecture"),
+    volumes=dict(
+        state="status",
+        volume_id="volume-id",
+        volume_type="volume-type",
+        snapshot_id="snapshot-id",
+        availability_zone="availability-zone",
+    ),
+    snapshots=dict(state="status", snapshot_id="snapshot-id", volume_id="volume-id"),
+)
+
+
+def rfilt(restype, **kwargs):
+    """ get filter for resource type. known fields are native filters and other keys are tags.
+    e.g. rfilt("instances", state="running", user="ubuntu") => instance-state-name and tag:user filters
+    """
+    fields = FIELDS[restype]
+    native = {fields[k]: kwargs.pop(k) for k in list(kwargs) if k in fields}
+    native = [dict(Name=k, Values=v if isinstance(v, list) else [v]) for k, v in native.items()]
+    return native + tfilt(**kwargs)
+
+
+def sortbydate(resources, attr, n=None):
+    """ return resources sorted by date attribute
+    :param n: return only the most recent n. only n are held in memory.
+    """
+    key = lambda r: getattr(r, attr)
+    if n is None:
+        return sorted(resources, key=key)
+    return sorted(heapq.nlargest(n, resources, key=key), key=key)
+
+
+# iterate filtered resources page by page ###############################
+
+
+def iter_instances(**kwargs):
+    yield from get_ec2().instances.filter(Filters=rfilt("instances", **kwargs))
+
+
+def iter_images(**kwargs):
+    yield from get_ec2().images.filter(Owners=["self"], Filters=rfilt("images", **kwargs))
+
+
+def iter_volumes(**kwargs):
+    yield from get_ec2().volumes.filter(Filters=rfilt("volumes", **kwargs))
+
 
+def iter_snapshots(**kwargs):
+    yield from get_ec2().snapshots.filter(OwnerIds=["self"], Filters=rfilt("snapshots", **kwargs))
 
-def get_instances(**kwargs):
-    # add shortcuts to filter
-    state = kwargs.pop("state", "")
-    r = list(ec2.instances.filter(Filters=tfilt(**kwargs)))
-    if state:
-        r = [i for i in r if i.state["Name"] == state]
-    return sorted(r, key=lambda s: s.launch_time)
 
+# get filtered lists of resources sorted by date. latest=n gets most recent n. ###############################
 
-def get_images(**kwargs):
-    r = list(ec2.images.filter(Owners=["self"], Filters=tfilt(**kwargs)))
-    return sorted(r, key=lambda s: s.creation_date)
 
+def get_instances(latest=None, **kwargs):
+    return sortbydate(iter_instances(**kwargs), "launch_time", latest)
 
-def get_volumes(**kwargs):
-    r = list(ec2.volumes.filter(Filters=tfilt(**kwargs)))
-    return sorted(r, key=lambda s: s.create_time)
 
+def get_images(latest=None, **kwargs):
+    return sortbydate(iter_images(**kwargs), "creation_date", latest)
 
-def get_snapshots(**kwargs):
-    r = list(ec2.snapshots.filter(OwnerIds=["self"], Filters=tfilt(**kwargs)))
-    return sorted(r, key=lambda s: s.start_time)
+
+def get_volumes(latest=None, **kwargs):
+    return sortbydate(iter_volumes(**kwargs), "create_time", latest)
+
+
+def get_snapshots(latest=None, **kwargs):
+    return sortbydate(iter_snapshots(**kwargs), "start_time", latest)
+
+
+def get_byid(awsid):
+    """ get resource using a single describe call
+    :param awsid: instance, image, volume or snapshot id
+    :return: aws resource or None if not found
+    """
+    types = dict(i="Instance", ami="Image", vol="Volume", snap="Snapshot")
+    from botocore.exceptions import ClientError
+    from boto3.exceptions import ResourceLoadException
+
+    res = getattr(get_ec2(), types[awsid.split("-")[0]])(awsid)
+    try:
+        res.load()
+    except (ClientError, ResourceLoadException):
+        return None
+    # describe_images returns an empty list for a deregistered image
+    if res.meta.data is None:
+        return None
+    return res
 
 
 def get_ips():
     """ get list of elastic ips """
-    return [ip["PublicIp"] for ip in client.describe_addresses()["Addresses"]]
+    return [ip["PublicIp"] for ip in get_client().describe_addresses()["Addresses"]]
+
+
+@dataclass
+class Inventory:
+    """ resources in the account at a point in time """
+
+    instances: list
+    images: list
+    volumes: list
+    snapshots: list
+    ips: list
+
+    @property
+    def running(self):
+        return [i for i in self.instances if i.state["Name"] == "running"]
+
+
+def get_inventory(max_workers=5):
+    """ get all resources using concurrent listings. wall time is the slowest listing rather than the sum.
+    :param max_workers: maximum concurrent listings
+    :return: Inventory
+    """
+    getters = dict(
+        instances=get_instances,
+        images=get_images,
+        volumes=get_volumes,
+        snapshots=get_snapshots,
+        ips=get_ips,
+    )
+    with ThreadPoolExecutor(max_workers) as executor:
+        futures = {k: executor.submit(f) for k, f in getters.items()}
+        return Inventory(**{k: f.result() for k, f in futures.items()})
 
 
 def show_all():
-    running = len(get_instances(state="running"))
+    inv = get_inventory()
     log.info(
-        f"running={running}; instances={len(get_instances())}; images={len(get_images())}; volumes={len(get_volumes())};"
-        f"snapshots={len(get_snapshots())}"
+        f"running={len(inv.running)}; instances={len(inv.instances)}; images={len(inv.images)}; volumes={len(inv.volumes)};"
+        f"snapshots={len(inv.snapshots)}; ips={len(inv.ips)}"
     )
 
 
@@ -89,75 +262,266 @@ def show_all():
 
 
 def get_instancesdf(**filters):
-    """ get dataframe of your instances """
-    from . import Instance
-
-    alldata = []
-    for i in get_instances(**filters):
-        i = Instance(i)
-        data = dict(
-            name=i.name,
-            instance_id=i.instance_id,
-            image=i.image_id,
-            type=i.instance_type,
-            state=i.state["Name"],
-            ip=i.public_ip_address,
+    """ get dataframe of your instances from describe_instances pages. no Instance objects are created. """
+    import pandas as pd
+
+    pager = get_client().get_paginator("describe_instances").paginate(
+        Filters=rfilt("instances", **filters)
+    )
+    instances = [i for page in pager for r in page["Reservations"] for i in r["Instances"]]
+    columns = ["InstanceId", "ImageId", "InstanceType", "State", "PublicIpAddress", "LaunchTime", "Tags"]
+    df = pd.DataFrame(instances, columns=columns).sort_values("LaunchTime", ignore_index=True)
+
+    data = pd.DataFrame(
+        dict(
+            instance_id=df.InstanceId,
+            image=df.ImageId,
+            type=df.InstanceType,
+            state=df.State.str.get("Name"),
+            ip=df.PublicIpAddress.fillna(""),
+        )
+    )
+    return join_tags(data, get_tagsdf(df.Tags))
+
+
+def get_volumesdf(**filters):
+    """ get dataframe of your volumes """
+    import pandas as pd
+
+    df = describe(
+        "describe_volumes",
+        "Volumes",
+        ["VolumeId", "Size", "State", "VolumeType", "AvailabilityZone", "CreateTime", "SnapshotId", "Attachments"],
+        Filters=rfilt("volumes", **filters),
+    ).sort_values("CreateTime", ignore_index=True)
+    data = pd.DataFrame(
+        dict(
+            volume_id=df.VolumeId,
+            size=df.Size.astype("int32"),
+            state=df.State.astype("category"),
+            type=df.VolumeType.astype("category"),
+            zone=df.AvailabilityZone.astype("category"),
+            created=pd.to_datetime(df.CreateTime, utc=True),
+            snapshot_id=df.SnapshotId,
+            # object dtype as all nan if no volume attached
+            instance_id=df.Attachments.str.get(0).astype(object).str.get("InstanceId"),
         )
-        tags = i.tags
-        tags.pop("Name", None)
-        data.update(tags)
+    )
+    return join_tags(data, get_tagsdf(df.Tags))
+
+
+def get_snapshotsdf(**filters):
+    """ get dataframe of your snapshots """
+    import pandas as pd
+
+    df = describe(
+        "describe_snapshots",
+        "Snapshots",
+        ["SnapshotId", "VolumeId", "VolumeSize", "State", "Progress", "StartTime", "Description"],
+        OwnerIds=["self"],
+        Filters=rfilt("snapshots", **filters),
+    ).sort_values("StartTime", ignore_index=True)
+    data = pd.DataFrame(
+        dict(
+            snapshot_id=df.SnapshotId,
+            volume_id=df.VolumeId,
+            size=df.VolumeSize.astype("int32"),
+            state=df.State.astype("category"),
+            progress=df.Progress.str.rstrip("%").replace("", "0").astype("int8"),
+            created=pd.to_datetime(df.StartTime, utc=True),
+            description=df.Description,
+        )
+    )
+    return join_tags(data, get_tagsdf(df.Tags))
+
+
+def get_imagesdf(**filters):
+    """ get dataframe of your images """
+    import pandas as pd
+
+    df = describe(
+        "describe_images",
+        "Images",
+        ["ImageId", "State", "Architecture", "EnaSupport", "CreationDate", "BlockDeviceMappings"],
+        Owners=["self"],
+        Filters=rfilt("images", **filters),
+    ).sort_values("CreationDate", ignore_index=True)
+    data = pd.DataFrame(
+        dict(
+            image_id=df.ImageId,
+            state=df.State.astype("category"),
+            architecture=df.Architecture.astype("category"),
+            ena=df.EnaSupport.fillna(False).astype(bool),
+            created=pd.to_datetime(df.CreationDate, utc=True),
+            snapshot_id=df.BlockDeviceMappings.str.get(0).str.get("Ebs").astype(object).str.get("SnapshotId"),
+        )
+    )
+    return join_tags(data, get_tagsdf(df.Tags))
+
+
+def describe(operation, key, columns, **kwargs):
+    """ return dataframe with columns and Tags from all pages of an ec2 describe call
+    :param operation: e.g. "describe_volumes"
+    :param key: key of the list in each page e.g. "Volumes"
+    :param kwargs: passed to operation
+    """
+    import pandas as pd
+
+    c = get_client()
+    if c.can_paginate(operation):
+        pages = c.get_paginator(operation).paginate(**kwargs)
+    else:
+        pages = [getattr(c, operation)(**kwargs)]
+    # keep only the columns required from each page
+    columns = columns + ["Tags"]
+    dfs = [pd.DataFrame(page[key], columns=columns) for page in pages]
+    return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=columns)
+
+
+def join_tags(data, tags):
+    """ return data with name column first and other tags as columns
+
+    tags with the same name as a column e.g. "size" become "size_tag". missing tags are "".
+    """
+    import pandas as pd
+
+    name = tags.pop("Name") if "Name" in tags else pd.Series(dtype=object)
+    data.insert(0, "name", name.reindex(data.index).fillna(""))
+    ncols = len(data.columns)
+    data = data.join(tags, rsuffix="_tag")
+    # after the join as rows with no tags are not in tags
+    tagcols = data.columns[ncols:]
+    data[tagcols] = data[tagcols].fillna("")
+    return data
+
+
+def get_tagsdf(tags):
+    """ return dataframe with a column for each tag key
+    :param tags: series of aws tag lists e.g. [dict(Key="Name", Value="fred")]
+    """
+    import pandas as pd
+
+    tags = tags.explode().dropna()
+    if tags.empty:
+        return pd.DataFrame(index=tags.index.unique())
+    tags = pd.DataFrame(tags.tolist(), index=tags.index)
+    tags = tags.pivot(columns="Key", values="Value")
+    tags.columns.name = None
+    return tags
+
+
+def get_instancetypes(region=None, ttl=7 * 24 * 3600, refresh=False):
+    """ return dataframe of instance types/features available in region
 
-        alldata.append(data)
-    # fillna for the tags
-    return pd.DataFrame(alldata).fillna("")
+    cached in local store as the pricing catalogue changes rarely. refetched if ttl expired and version changed.
+
+    :param region: default is the configured region
+    :param ttl: seconds before checking the catalogue version
+    :param refresh: True to ignore the cache
+    """
+    from . import store
+
+    region = region or get_session().region_name
+    table = f"instancetypes_{region}"
+    latest = None
+    if not refresh:
+        df = store.read(table)
+        if df is not None:
+            updated, version = store.get_meta(table)
+            if time() - updated < ttl:
+                return df
+            latest = get_pricingversion(region)
+            if latest and latest == version:
+                log.info("pricing catalogue unchanged")
+                store.set_meta(table, version)
+                return df
+
+    log.info("fetching pricing catalogue")
+    version = latest or get_pricingversion(region)
+    df = fetch_instancetypes(region)
+    store.write(df, table, version)
+    return df
+
+
+def get_pricingversion(region):
+    """ return etag of the published ec2 price list for region. None if not available """
+    import requests
+
+    url = f"https://pricing.us-east-1.amazonaws.com/offers/v1.0/aws/AmazonEC2/current/{region}/index.json"
+    try:
+        r = requests.head(url, timeout=10)
+        r.raise_for_status()
+    except requests.RequestException:
+        log.warning("cannot get pricing version")
+        return None
+    return r.headers.get("ETag")
 
 
-def get_instancetypes():
-    """ return dataframe of instance types/features available in EU
+def fetch_instancetypes(region):
+    """ return dataframe of instance types/features available in region from the pricing api
     """
+    import pandas as pd
+
     # API only available in specific regions
-    pricing = boto3.client("pricing", "us-east-1")
+    pricing = get_client("pricing", "us-east-1")
 
     pager = pricing.get_paginator("get_products").paginate(
         ServiceCode="AmazonEC2",
         Filters=[
-            dict(Type="TERM_MATCH", Field="location", Value="EU (Ireland)"),
+            dict(Type="TERM_MATCH", Field="regionCode", Value=region),
             dict(Type="TERM_MATCH", Field="tenancy", Value="Shared"),
             dict(Type="TERM_MATCH", Field="operatingSystem", Value="Linux"),
         ],
         PaginationConfig=dict(MaxItems=1e4),
     )
-    pages = [page["PriceList"] for page in pager]
-    products = list(itertools.chain.from_iterable(pages))
-    attribs = [json.loads(v)["product"]["attributes"] for v in products]
-    df = pd.DataFrame(attribs)
+    # stream products as each page arrives. keep first of each instance type.
+    products = (product for page in pager for product in page["PriceList"])
+    rows = dict()
+    for attribs in map(parse_attributes, products):
+        itype = attribs.get("instanceType")
+        if itype is None or itype in rows:
+            continue
+        memory = re.search(r"(\d+)", attribs.get("memory", "").replace(",", ""))
+        attribs["memory"] = int(memory.group(1)) if memory else 0
+        if attribs["memory"] == 0:
+            continue
+        attribs["gpu"] = int(attribs.get("gpu", 0))
+        attribs["vcpu"] = int(attribs.get("vcpu", 0))
+        rows[itype] = attribs
+    df = pd.DataFrame(list(rows.values()))
     df.columns = standardise(df.columns)
-    df = df.loc[df.instance_type.notnull()]
-    df.gpu = df.gpu.fillna(0).astype(int)
-    df.vcpu = df.vcpu.fillna(0).astype(int)
-    df.memory = (
-        df.memory.str.replace(",", "")
-        .str.extract("(\d+)", expand=False)
-        .fillna(0)
-        .astype(int)
-    )
-    df = df[df.memory > 0].drop_duplicates(["instance_type"])
 
     return df
 
 
-def get_spotprices():
+ATTRIBUTES = re.compile(r'"attributes"\s*:\s*')
+DECODER = json.JSONDecoder()
+
+
+def parse_attributes(product):
+    """ return product attributes from pricing api product json. parses attributes only not the large terms block """
+    match = ATTRIBUTES.search(product)
+    if not match:
+        return json.loads(product)["product"]["attributes"]
+    return DECODER.raw_decode(product, match.end())[0]
+
+
+def get_spotprices(region=None):
     """ return dataframe of spot prices
 
+        :param region: default is the configured region
+
         standardised columns available for query/sort::
 
-        clock_speed, current_generation, dedicated_ebs_throughput, ecu, enhanced_networking_supported, gpu, instance_family, instance_type, intel_avx2available, intel_avx_available, intel_turbo_available, license_model, location, location_type, memory, network_performance, normalization_size_factor, operating_system, operation, physical_processor, pre_installed_sw, processor_architecture, processor_features, servicecode, servicename, storage, tenancy, usagetype, vcpu, availability_zone, spot_price, percpu, per64cpu
+        clock_speed, current_generation, dedicated_ebs_throughput, ecu, enhanced_networking_supported, gpu, instance_family, instance_type, intel_avx2available, intel_avx_available, intel_turbo_available, license_model, location, location_type, memory, network_performance, normalization_size_factor, operating_system, operation, physical_processor, pre_installed_sw, processor_architecture, processor_features, servicecode, servicename, storage, tenancy, usagetype, vcpu, availability_zone, spot_price, region, percpu, per64cpu
     """
+    import pandas as pd
 
-    itypes = get_instancetypes()
+    region = region or get_session().region_name
+    itypes = get_instancetypes(region)
 
     # get current spot prices
-    pager = client.get_paginator("describe_spot_price_history").paginate(
+    pager = get_client("ec2", region).get_paginator("describe_spot_price_history").paginate(
         StartTime=f"{datetime.utcnow()}Z",
         ProductDescriptions=["Linux/UNIX"],
         PaginationConfig=dict(MaxItems=1e4),
@@ -168,6 +532,7 @@ def get_spotprices():
     prices.columns = standardise(prices.columns)
     prices = prices[["availability_zone", "instance_type", "spot_price"]]
     prices.spot_price = prices.spot_price.astype(float)
+    prices["region"] = region
 
     # merge
     merged = itypes.merge(prices, on="instance_type", how="inner")
@@ -175,6 +540,58 @@ def get_spotprices():
     merged["per64cpu"] = merged.percpu * 64
     return merged.sort_values("percpu")
 
+
+def select_instancetypes(
+    prices=None,
+    min_vcpu=0,
+    min_memory=0,
+    min_gpu=0,
+    generation="current",
+    architecture="x86_64",
+    zones=None,
+    by="spot_price",
+    n=10,
+):
+    """ return dataframe of cheapest instance types that fit the constraints
+
+    :param prices: dataframe from get_spotprices or scan_spotprices. default is the configured region.
+    :param min_vcpu: minimum vcpus
+    :param min_memory: minimum memory GiB
+    :param min_gpu: minimum gpus
+    :param generation: "current", "previous" or None for any
+    :param architecture: "x86_64", "arm64" or None for any
+    :param zones: list of availability zones allowed. None for any.
+    :param by: column to rank by e.g. spot_price, percpu
+    :param n: number of candidates
+    :return: same columns as get_spotprices ranked by cheapest. one row per instance type and zone.
+    """
+    df = get_spotprices() if prices is None else prices
+    fits = (df.vcpu >= min_vcpu) & (df.memory >= min_memory) & (df.gpu >= min_gpu)
+    if generation:
+        fits &= (df.current_generation == "Yes") == (generation == "current")
+    if architecture:
+        arm = df.physical_processor.fillna("").str.contains("Graviton")
+        fits &= arm == (architecture == "arm64")
+    if zones:
+        fits &= df.availability_zone.isin(zones)
+    return df[fits].sort_values([by, "instance_type"]).head(n)
+
+
+def scan_spotprices(regions=None, max_workers=8):
+    """ return dataframe of spot prices in all regions. regions are queried concurrently.
+
+    :param regions: list of regions. default is all enabled regions.
+    :param max_workers: maximum concurrent regions
+    :return: same columns as get_spotprices sorted by percpu
+    """
+    import pandas as pd
+
+    regions = regions or get_regions()
+    with ThreadPoolExecutor(max_workers) as executor:
+        dfs = list(executor.map(get_spotprices, regions))
+    return pd.concat(dfs, ignore_index=True).sort_values("percpu")
+
+
 def standardise(names):
     """ pep8 names
     :return: list of names that are underscore separated and lower case
@@ -0,0 +1,146 @@
+"""
+price/performance of instance types
+    runs a workload on each candidate instance type and records wall time, throughput and spot price
+    reports cost per unit of work so types are chosen by measured throughput per dollar rather than vcpus
+    executor is pluggable. local runs on this machine for testing. spot launches an instance for each type.
+
+e.g.::
+
+    benchmark.run("python train.py", ["c5.large", "c5.xlarge"], executor=benchmark.spot("myimage"), units=1000)
+    benchmark.report()
+"""
+import logging
+import subprocess
+from contextlib import contextmanager
+from time import perf_counter, time
+
+import pandas as pd
+
+from . import aws, store
+
+log = logging.getLogger(__name__)
+
+TABLE = "benchmarks"
+
+
+@contextmanager
+def connect():
+    """ connection to local store with benchmarks table """
+    with store.connect() as con:
+        con.execute(
+            f"create table if not exists {TABLE} ("
+            "timestamp real, name text, instance_type text, wall real, units real, "
+            "throughput real, spot_price real)"
+        )
+        yield con
+
+
+@contextmanager
+def local(instance_type=None):
+    """ executor that runs commands on this machine. instance_type is only a label. """
+
+    def run(command):
+        subprocess.run(command, shell=True, check=True, capture_output=True)
+
+    yield run
+
+
+def spot(name, **kwargs):
+    """ return executor that launches a new spot instance of each type and terminates it after the workload
+
+    :param name: image name with the workload installed
+    :param kwargs: passed to Spot.fleet e.g. specfile, user
+
+    instances are named f"{name}-bench-{instance_type}-0". an existing instance called name is never used.
+    """
+    from . import Spot
+
+    if not aws.get_images(name=name, latest=1):
+        raise ValueError(f"no image named {name}")
+
+    @contextmanager
+    def executor(instance_type):
+        launched = Spot.fleet(name, 1, instance_type, prefix=f"{name}-bench-{instance_type}", **kwargs)
+        if not launched:
+            raise Exception(f"cannot launch {instance_type}")
+        instance = launched[0]
+        try:
+            yield lambda command: instance.run(command, hide="both")
+        finally:
+            instance.terminate(save=False)
+
+    return executor
+
+
+def run(command, instance_types, executor=local, units=1, repeat=1, name=None, prices=None):
+    """ run workload on each instance type and store the results
+
+    :param command: shell command that runs the workload
+    :param instance_types: list of instance types
+    :param executor: function(instance_type) that returns a context manager yielding run(command)
+    :param units: units of work done by one run of command e.g. rows processed. throughput is units/second.
+    :param repeat: runs of command on each instance. each run is stored.
+    :param name: workload name in the store. default is command.
+    :param prices: dataframe from get_spotprices. default is the configured region if executor is not local.
+    :return: dataframe of results added to the store
+    """
+    name = name or command
+    if prices is None and executor is not local:
+        prices = aws.get_spotprices()
+    # cheapest zone as that is where a spot request is usually fulfilled
+    prices = dict() if prices is None else prices.groupby("instance_type").spot_price.min()
+
+    rows = []
+    for itype in instance_types:
+        log.info(f"benchmarking {name} on {itype}")
+        try:
+            with executor(itype) as execute:
+                for _ in range(repeat):
+                    start = perf_counter()
+                    execute(command)
+                    wall = perf_counter() - start
+                    rows.append(
+                        (time(), name, itype, wall, units, units / wall, prices.get(itype))
+                    )
+        except Exception:
+            log.exception(f"benchmark failed on {itype}")
+
+    with connect() as con:
+        con.executemany(f"insert into {TABLE} values (?, ?, ?, ?, ?, ?, ?)", rows)
+    store.set_meta(TABLE)
+    return pd.DataFrame(
+        rows,
+        columns=["timestamp", "name", "instance_type", "wall", "units", "throughput", "spot_price"],
+    )
+
+
+def get_results(name=None):
+    """ return dataframe of stored benchmark runs
+
+    :param name: optional workload name
+    """
+    with connect() as con:
+        df = pd.read_sql(f"select * from {TABLE}", con)
+    if name:
+        df = df[df.name == name]
+    df["timestamp"] = pd.to_datetime(df.timestamp, unit="s", utc=True)
+    return df
+
+
+def report(name=None):
+    """ return dataframe of cost per unit of work for each workload and instance type
+
+    :param name: optional workload name
+    :return: runs, mean wall, throughput, spot_price, cost_per_unit and units_per_dollar sorted by cost_per_unit
+    """
+    df = get_results(name)
+    stats = df.groupby(["name", "instance_type"]).agg(
+        runs=("wall", "count"),
+        wall=("wall", "mean"),
+        throughput=("throughput", "mean"),
+        spot_price=("spot_price", "mean"),
+    )
+    # spot price is per hour
+    stats["cost_per_unit"] = stats.spot_price / (stats.throughput * 3600)
+    stats["units_per_dollar"] = 1 / stats.cost_per_unit
+    return stats.sort_values("cost_per_unit")
@@ -0,0 +1,113 @@
+"""
+instance names in the hosts file and ssh config
+    files are only written when an entry changes
+    files are replaced atomically
+    many instances can be updated with one write
+"""
+import logging
+import os
+import platform
+import tempfile
+import threading
+from os.path import dirname, expanduser
+
+log = logging.getLogger(__name__)
+
+if platform.system() == "Windows":
+    HOSTFILE = r"C:\Windows\System32\drivers\etc\hosts"
+else:
+    HOSTFILE = "/etc/hosts"
+SSHCONFIG = f"{expanduser('~')}/.ssh/config"
+
+# name => ip already in files
+known = dict()
+lock = threading.Lock()
+
+
+def register(instances):
+    """ add names of instances with ip and user to hosts and ssh config """
+    update({i.name: i.public_ip_address for i in instances if i.user})
+
+
+def update(entries):
+    """ set ip for names in hosts and ssh config. writes only if changed.
+    :param entries: dict of name => ip
+    """
+    with lock:
+        entries = {
+            name: ip for name, ip in entries.items() if name and ip and known.get(name) != ip
+        }
+        if not entries:
+            return
+        update_hosts(entries)
+        update_sshconfig(entries)
+        known.update(entries)
+
+
+def update_hosts(entries):
+    """ use name as shortcut to ip """
+    with open(HOSTFILE) as f:
+        before = f.read()
+    existing = {x.strip() for x in before.splitlines()}
+    entries = {name: ip for name, ip in entries.items() if f"{ip} {name}" not in existing}
+    if not entries:
+        return
+    lines = [
+        x for x in before.splitlines(keepends=True)
+        if not any(x.rstrip("\n").endswith(f" {name}") for name in entries)
+    ]
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+    lines.extend(f"{ip} {name}\n" for name, ip in entries.items())
+    try:
+        write(HOSTFILE, "".join(lines))
+    except PermissionError:
+        log.warning(f"add write access to {HOSTFILE} to add new host")
+
+
+def update_sshconfig(entries):
+    """ add settings to avoid the prompts and warnings for new ip addresses """
+    from sshconf import read_ssh_config
+
+    os.makedirs(dirname(SSHCONFIG), exist_ok=True)
+    open(SSHCONFIG, "a").close()
+    c = read_ssh_config(SSHCONFIG)
+    before = c.config()
+    for name, ip in entries.items():
+        try:
+            # other settings are left untouched
+            c.set(name, HostName=ip)
+        except ValueError:
+            # defaults
+            c.add(
+                name,
+                HostName=ip,
+                User="ubuntu",
+                # dont prompt for unknown host; nor add to known hosts; nor warn re adding known host
+                StrictHostKeyChecking="no",
+                UserKnownHostsFile="/dev/null",
+                LogLevel="QUIET",
+            )
+    after = c.config()
+    if after != before:
+        write(SSHCONFIG, after)
+
+
+def write(path, text):
+    """ replace file atomically. writes in place if file cannot be replaced e.g. folder not writable. """
+    try:
+        fd, temp = tempfile.mkstemp(dir=dirname(path))
+    except OSError:
+        fd = None
+    if fd is not None:
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+            if os.path.exists(path):
+                os.chmod(temp, os.stat(path).st_mode)
+            os.replace(temp, path)
+            return
+        except OSError:
+            os.remove(temp)
+    with open(path, "w") as f:
+        f.write(text)
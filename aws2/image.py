@@ -7,6 +7,8 @@ log = logging.getLogger(__name__)
 class Image(Resource):
     """ aws image resource """
 
+    idprefix = "ami-"
+
     def __init__(self, res):
         self.coll = aws.get_images
         super().__init__(res)
@@ -23,7 +25,7 @@ class Image(Resource):
         instance = Spot(ami)
         instance.start()
         volume = Volume(ami)
-        instance.terminate()
+        instance.terminate(wait=True)
 
         # save volume with new name
         volume.name = name
@@ -32,8 +34,23 @@ class Image(Resource):
         volume.delete()
 
     def set_ena(self):
-        """ sets ena on image """
-        from . import Instance
-
-        i = Instance(self.name)
-        i.stop(save=True, ena=True)
+        """ sets ena on image. registers the same snapshots again with ena and deregisters this image """
+        from . import Snapshot
+
+        # all volumes. encrypted is not allowed with a snapshot as it is inherited.
+        bdms = []
+        for bdm in self.block_device_mappings:
+            bdm = dict(bdm)
+            if "Ebs" in bdm:
+                bdm["Ebs"] = {k: v for k, v in bdm["Ebs"].items() if k != "Encrypted"}
+            bdms.append(bdm)
+        root = next(bdm for bdm in bdms if bdm["DeviceName"] == self.root_device_name)
+        snapshot = Snapshot(aws.ec2.Snapshot(root["Ebs"]["SnapshotId"]))
+        snapshot.register_image(
+            self.name,
+            ena=True,
+            Architecture=self.architecture,
+            BlockDeviceMappings=bdms,
+            RootDeviceName=self.root_device_name,
+            VirtualizationType=self.virtualization_type,
+        )
@@ -1,38 +1,32 @@
 import logging
 import os
 import uuid
-from os.path import expanduser, join
-from time import sleep
-import platform
-import socket
+from os.path import join
 
-import pyperclip
-import requests
-import yaml
-from fabric import Connection
-from sshconf import read_ssh_config
-
-from . import Resource, aws
+from . import Resource, aws, hosts, jobs, ports, sshpool
 
 log = logging.getLogger(__name__)
 
 HERE = os.path.dirname(__file__)
-HOME = os.path.expanduser("~")
 
 class Instance(Resource):
     """ aws instance resource """
 
-    def __init__(self, res, instance_type=None, specfile=None, user="ubuntu"):
+    idprefix = "i-"
+
+    def __init__(self, res, instance_type=None, specfile=None, user="ubuntu", **constraints):
         """
         wrap aws.ec2.Instance or start a new one
 
         :param res: name, id, aws.ec2.Instance, Instance
-        :param instance_type: overrides the instance type in spec
+        :param instance_type: overrides the instance type in spec. "auto" selects the cheapest that fits constraints.
         :param specfile: optional aws instance specification. if None then f"{res}.yaml" or default.yaml
         :param user: username for ssh connection to new instance
+        :param constraints: passed to aws.select_instancetypes if instance_type="auto" e.g. min_vcpu=8, min_gpu=1
 
         Less frequently changed parameters are in specfile
         """
+        check_constraints(instance_type, constraints)
         self.coll = aws.get_instances
         super().__init__(res)
 
@@ -43,15 +37,31 @@ class Instance(Resource):
 
         # new instance
         name = res
-        spec = self.get_spec(name, instance_type, specfile)
-        res = self.create(spec)
+        spec = self.get_spec(name, instance_type, specfile, **constraints)
+        with jobs.phase("create"):
+            res = self.create(spec)
         if res is None:
             return
         self.res = res
         self.name = name
         self.user = user
-        self.connection = None
-        self.post_launch()
+        with jobs.phase("configure"):
+            self.post_launch()
+
+    @classmethod
+    def launch(cls, name, **kwargs):
+        """ start a new instance in the background without blocking
+
+        :param name: name of new instance
+        :param kwargs: passed to __init__ e.g. instance_type, specfile, user
+        :return: Job with result the new instance. job.state shows progress.
+
+        e.g. start several and wait for all::
+
+            launches = [Spot.launch(f"worker{i}") for i in range(12)]
+            workers = [job.result() for job in launches]
+        """
+        return jobs.Job(cls, (name,), kwargs, name=f"launch {name}")
 
     @property
     def user(self):
@@ -68,9 +78,10 @@ class Instance(Resource):
 
         return [Volume(v) for v in list(self.res.volumes.all())]
 
-    def get_spec(self, name, instance_type, specfile):
+    def get_spec(self, name, instance_type, specfile, **constraints):
         """ load instance specification
-        :return: (spec, nonaws) that are dict of aws spec and nonaws variables
+        :param constraints: passed to aws.select_instancetypes if instance_type="auto"
+        :return: dict of aws spec
         """
         if specfile:
             pass
@@ -78,12 +89,23 @@ class Instance(Resource):
             specfile = f"{HERE}/{name}.yaml"
         else:
             specfile = f"{HERE}/default.yaml"
+        check_constraints(instance_type, constraints)
+        import yaml
+
         spec = yaml.safe_load(open(specfile))
-        if instance_type:
+        if instance_type == "auto":
+            candidates = aws.select_instancetypes(n=1, **constraints)
+            if candidates.empty:
+                raise ValueError(f"no instance type available for {constraints}")
+            best = candidates.iloc[0]
+            log.info(f"selected {best.instance_type} in {best.availability_zone} at {best.spot_price}")
+            spec["InstanceType"] = best.instance_type
+            spec.setdefault("Placement", dict())["AvailabilityZone"] = best.availability_zone
+        elif instance_type:
             spec["InstanceType"] = instance_type
         try:
             # image found for name
-            spec["ImageId"] = aws.get_images(name=name)[-1].id
+            spec["ImageId"] = aws.get_images(name=name, latest=1)[-1].id
         except IndexError:
             pass
         return spec
@@ -95,14 +117,17 @@ class Instance(Resource):
         res.wait_until_running()
         return res
 
-    def post_launch(self):
-        """ set tags on running instance and run setup scripts """
+    def post_launch(self, register=True):
+        """ set tags on running instance and run setup scripts
+
+        :param register: add name to hosts and ssh config. False if done for many instances at once.
+        """
         self.volumes[0].name = self.name
-        self.set_connection()
+        if register:
+            self.set_connection()
         wait_port(self.public_ip_address, 22)
         self.sudo("cp /usr/share/zoneinfo/Europe/London /etc/localtime")
         self.optimise()
-        self.connection.close()
 
     def stop(self, save=True, ena=False):
         """ stop and set ena or save as image
@@ -113,6 +138,7 @@ class Instance(Resource):
         # stop
         log.info(f"stopping instance")
         self.res.stop()
+        self.invalidate()
 
         if ena or save:
             waiter = aws.client.get_waiter("instance_stopped")
@@ -131,13 +157,14 @@ class Instance(Resource):
     def terminate(self):
         """ release name and terminate """
         self.res.terminate()
+        self.invalidate()
         self.name = ""
 
     def create_image(self, name=None):
         """ blocking save to image
         :param name: saved image name. default self.name
         """
-        from . import Image, Snapshot
+        from . import Image, Snapshot, retention
 
         if name is None:
             name = self.name
@@ -148,71 +175,31 @@ class Instance(Resource):
         image.wait_until_exists(Filters=aws.filt(state="available"))
         image.name = name
 
-        # name the snapshot and count
+        # name the snapshot
         snapshotid = image.block_device_mappings[0]["Ebs"]["SnapshotId"]
         snapshot = Snapshot(snapshotid)
         snapshot.name = name
+
+        # deregister all except latest and delete their snapshots
+        retention.apply(retention.plan([name], retention.Policy(replaced=True)))
         snapcount = len(aws.get_snapshots(name=name))
         log.info(f"You now have {snapcount} {name} snapshots")
 
-        # deregister all except latest
-        images = aws.get_images(name=name)
-        for image in images[:-1]:
-            aws.client.deregister_image(ImageId=image.id)
-
     ############# fabric ########################################################################
 
-    def set_connection(self):
-        name = self.name
+    @property
+    def connection(self):
+        """ shared ssh connection from pool. None if no ip or user """
         ip = self.public_ip_address
         if not ip or not self.user:
-            return
-
-        try:
-            self.connection.close()
-        except AttributeError:
-            pass
+            return None
+        return sshpool.get(ip, self.user)
 
-        self.connection = Connection(
-            ip,
-            user=self.user,
-            connect_kwargs=dict(key_filename=join(expanduser("~"), ".aws/key")),
-        )
-        # add to hosts to use name as shortcut to ip
-        if platform.system()=="Windows":
-            hostfile = r"C:\Windows\System32\drivers\etc\hosts"
-        else:
-            hostfile = "/etc/hosts"
-        with open(hostfile) as f:
-            hosts = f.readlines()
-        try:
-            with open(hostfile, "w") as f:
-                for x in hosts:
-                    if x.rstrip("\n").endswith(f" {name}"):
-                        continue
-                    f.write(x)
-                f.write(f"{ip} {name}\n")
-        except PermissionError:
-            log.warning(f"add write access to {hostfile} to add new host")
-
-        # add settings to ssh file to avoid the prompts and warnings for new ip addresses
-        fname = f"{HOME}/.ssh/config"
-        open(fname, "a").close()
-        c = read_ssh_config(fname)
-        try:
-            # other settings are left untouched
-            c.set(name, HostName=ip)
-        except ValueError:
-            # defaults
-            c.add(name, 
-                        HostName=ip, 
-                        User="ubuntu", 
-                        # dont prompt for unknown host; nor add to known hosts; nor warn re adding known host
-                        StrictHostKeyChecking="no",
-                        UserKnownHostsFile="/dev/null",
-                        LogLevel="QUIET"
-                        )
-        c.save()
+    def set_connection(self):
+        """ add name to hosts and ssh config """
+        if not self.public_ip_address or not self.user:
+            return
+        hosts.update({self.name: self.public_ip_address})
 
     def optimise(self):
         """ optimse settings for gpu
@@ -230,10 +217,12 @@ class Instance(Resource):
             self.sudo("nvidia-smi -ac 2505,1177", hide="stdout")
 
     def run(self, *args, **kwargs):
-        return self.connection.run(*args, **kwargs)
+        with sshpool.using(self.public_ip_address, self.user) as c:
+            return c.run(*args, **kwargs)
 
     def sudo(self, *args, **kwargs):
-        return self.connection.sudo(*args, **kwargs)
+        with sshpool.using(self.public_ip_address, self.user) as c:
+            return c.sudo(*args, **kwargs)
 
     def set_ip(self, ip=0):
         """ sets ip address
@@ -242,7 +231,7 @@ class Instance(Resource):
             ip = aws.get_ips()[ip]
         if ip is not None:
             aws.client.associate_address(InstanceId=self.id, PublicIp=ip)
-            self.refresh()
+            self.invalidate()
             self.set_connection()
         copyclip(ip)
         log.info(f"ip={ip}. added to clipboard")
@@ -255,8 +244,11 @@ class Instance(Resource):
         self.run("./jupyter.sh", hide="both")
         wait_port(self.public_ip_address, 8888)
 
-    def nb2local(self, src, dst, dryrun=False):
-        """ download .ipynb to local machine """
+    def nb2local(self, src, dst, dryrun=False, sync=True):
+        """ download .ipynb to local machine
+
+        :param sync: download only changed notebooks as one compressed stream. False downloads each file.
+        """
 
         src = f"/home/ubuntu/{src}"
         dst = f"c:/users/simon/documents/py/{dst}"
@@ -264,6 +256,10 @@ class Instance(Resource):
             log.info(f"{src}==>{dst}")
             return
 
+        if sync:
+            self.download(src, dst, "*.ipynb")
+            return
+
         r = self.run(f"find {src} -name *.ipynb", hide="stdout")
         nbs = r.stdout.splitlines()
         for nb in nbs:
@@ -276,23 +272,86 @@ class Instance(Resource):
                 os.makedirs(os.path.dirname(dstfile), exist_ok=True)
                 self.connection.get(nb, dstfile)
 
+    def download(self, src, dst, pattern="*", checksum=False):
+        """ download files that differ from local copy as one compressed tar stream over a single channel
+
+        :param src: remote folder
+        :param dst: local folder
+        :param pattern: files to find. checkpoints are excluded.
+        :param checksum: compare md5 hashes. default compares mtime and size.
+        :return: list of paths downloaded relative to src
+        """
+        import posixpath
+        import tarfile
+        from shlex import quote
+
+        find = f"cd {quote(src)} && find . -type f -name {quote(pattern)} -not -path '*/.ipynb_checkpoints/*'"
+        if checksum:
+            r = self.run(f"{find} -exec md5sum {{}} +", hide="stdout")
+            remote = dict(reversed(line.split("  ", 1)) for line in r.stdout.splitlines())
+            # remote paths are posix on any client
+            remote = {posixpath.normpath(k): v for k, v in remote.items()}
+            local = {path: md5(join(dst, path)) for path in remote}
+        else:
+            r = self.run(f"{find} -printf '%T@ %s %P\\n'", hide="stdout")
+            remote = dict()
+            for line in r.stdout.splitlines():
+                mtime, size, path = line.split(" ", 2)
+                remote[path] = (int(float(mtime)), int(size))
+            local = {path: stat(join(dst, path)) for path in remote}
+        changed = [path for path in remote if remote[path] != local[path]]
+        if not changed:
+            log.info(f"{dst} is up to date")
+            return []
+
+        log.info(f"downloading {len(changed)} changed files")
+        os.makedirs(dst, exist_ok=True)
+        with sshpool.using(self.public_ip_address, self.user) as c:
+            stdin, stdout, stderr = c.client.exec_command(f"tar czf - -C {quote(src)} -T -")
+            stdin.write("\n".join(changed))
+            stdin.channel.shutdown_write()
+            with tarfile.open(fileobj=stdout, mode="r|gz") as tar:
+                tar.extractall(dst)
+            if stdout.channel.recv_exit_status():
+                raise OSError(f"download from {src} failed. {stderr.read().decode()}")
+        return changed
+
 
 # utils ############################################################################################
 
-def port_open(ip, port):
-    """ return true of open """
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        result = sock.connect_ex((ip, port))
-    return result==0
+def check_constraints(instance_type, constraints):
+    """ raise TypeError if constraints given without instance_type="auto" e.g. a misspelt argument """
+    if constraints and instance_type != "auto":
+        raise TypeError(f"unexpected arguments {list(constraints)}. constraints require instance_type='auto'")
 
-def wait_port(ip, port):
-    """ block until port available """
-    log.info(f"waiting for {ip}:{port}")
-    while not port_open(ip, port):
-        sleep(1)
+def wait_port(ip, port, **kwargs):
+    """ block until port available. raises TimeoutError after deadline.
+    :param kwargs: passed to ports.wait_port e.g. deadline
+    """
+    ports.wait([(ip, port)], **kwargs)
+
+def stat(path):
+    """ return (mtime, size) of local file. None if not found """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return int(st.st_mtime), st.st_size
+
+def md5(path):
+    """ return md5 hex digest of local file. None if not found """
+    import hashlib
+
+    try:
+        with open(path, "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
 
 def copyclip(text):
     """ copy to clipboard """
+    import pyperclip
+
     try:
         pyperclip.copy(text)
     except Exception:
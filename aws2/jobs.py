@@ -0,0 +1,98 @@
+"""
+background jobs that return a future and report progress
+    Job runs a function in a thread
+    phase records the state and duration of each step of the current job
+
+NOTE: functions can call phase whether or not they run in a job
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import ALL_COMPLETED, Future
+from concurrent.futures import wait as wait_futures
+from contextlib import contextmanager
+from time import time
+
+log = logging.getLogger(__name__)
+
+# job running in the current thread
+current = threading.local()
+
+
+class Job:
+    """ run a function in a background thread
+
+    state is "pending", then the name of each phase, then "done" or "failed"
+    timings has the seconds taken by each phase
+    can be awaited in asyncio or waited using result()
+    """
+
+    def __init__(self, target, args=(), kwargs=None, name=None):
+        """
+        :param target: function to run
+        :param args: args for target
+        :param kwargs: kwargs for target
+        :param name: name for logging
+        """
+        self.name = name or target.__name__
+        self.state = "pending"
+        self.timings = dict()
+        self.future = Future()
+        self.thread = threading.Thread(
+            target=self._run, args=(target, args, kwargs or dict()), name=self.name
+        )
+        self.thread.start()
+
+    def __repr__(self):
+        return f"Job {self.name} ({self.state})"
+
+    def __await__(self):
+        return asyncio.wrap_future(self.future).__await__()
+
+    def _run(self, target, args, kwargs):
+        current.job = self
+        self.future.set_running_or_notify_cancel()
+        start = time()
+        try:
+            result = target(*args, **kwargs)
+        except BaseException as e:
+            self.state = "failed"
+            log.exception(f"{self.name} failed")
+            self.future.set_exception(e)
+        else:
+            self.state = "done"
+            self.future.set_result(result)
+        finally:
+            self.timings["total"] = time() - start
+            current.job = None
+
+    def result(self, timeout=None):
+        """ block until done and return result or raise exception """
+        return self.future.result(timeout)
+
+    def done(self):
+        return self.future.done()
+
+
+@contextmanager
+def phase(name):
+    """ record state and duration of a step of the current job. does nothing outside a job """
+    job = getattr(current, "job", None)
+    if job is None:
+        yield
+        return
+    job.state = name
+    start = time()
+    try:
+        yield
+    finally:
+        job.timings[name] = time() - start
+
+
+def wait(jobs, timeout=None, return_when=ALL_COMPLETED):
+    """ block until jobs complete
+    :return: (done, notdone) sets of jobs
+    """
+    futures = {job.future: job for job in jobs}
+    done, notdone = wait_futures(futures, timeout, return_when)
+    return {futures[f] for f in done}, {futures[f] for f in notdone}
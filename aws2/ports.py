@@ -0,0 +1,69 @@
+"""
+wait for ports to accept connections
+    probes many ip:port concurrently using asyncio
+    timeout for each attempt, exponential backoff between attempts and an overall deadline
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+async def probe(ip, port, timeout=2):
+    """ return True if port accepts a connection within timeout seconds """
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+
+async def wait_port(ip, port, deadline=600, timeout=2, delay=1, maxdelay=15):
+    """ wait until port open
+
+    :param deadline: seconds before TimeoutError
+    :param timeout: seconds for each attempt
+    :param delay: seconds before second attempt. doubles for each attempt up to maxdelay.
+    """
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline
+    while not await probe(ip, port, timeout):
+        remaining = end - loop.time()
+        if remaining <= 0:
+            raise TimeoutError(f"{ip}:{port} not open after {deadline} seconds")
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, maxdelay)
+
+
+async def wait_ports(targets, **kwargs):
+    """ wait until all ports open. stops early if any fails.
+
+    :param targets: list of (ip, port)
+    :param kwargs: passed to wait_port
+    """
+    tasks = [asyncio.ensure_future(wait_port(ip, port, **kwargs)) for ip, port in targets]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def wait(targets, **kwargs):
+    """ block until all ports open. raises TimeoutError on first failure.
+
+    :param targets: list of (ip, port)
+    :param kwargs: passed to wait_port e.g. deadline
+    """
+    log.info(f"waiting for {', '.join(f'{ip}:{port}' for ip, port in targets)}")
+    coro = wait_ports(targets, **kwargs)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    # event loop already running in this thread e.g. jupyter
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coro).result()
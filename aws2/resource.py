@@ -1,13 +1,29 @@
 import logging
+import re
+from functools import wraps
+from time import time
+
+from . import aws
 
 log = logging.getLogger(__name__)
 
+# (idprefix, name) => (id, time) for most recent resource with name. avoids listing the collection by name.
+names = dict()
+# seconds that names entries are used before listing the collection again
+NAME_TTL = 60
+
 
 class Resource:
     """ base class to wrap an AWS resource
     """
 
     res = None
+    # prefix of aws id e.g. "i-" for instances
+    idprefix = None
+
+    # seconds that values read from the embedded aws resource are reused before a new describe call
+    ttl = 5
+    _loaded = 0
 
     def __init__(self, res):
         """
@@ -27,19 +43,19 @@ class Resource:
             self.res = res
             return
 
-        # name of existing resource. gets most recent.
-        try:
-            self.res = self.coll(Name=res)[-1]
-            return
-        except IndexError:
-            pass
+        if isinstance(res, str):
+            # aws id. single describe call.
+            if self.idprefix and re.fullmatch(f"{self.idprefix}[0-9a-f]+", res):
+                self.res = aws.get_byid(res)
+                if self.res:
+                    self._loaded = time()
+                    return
 
-        # aws id
-        try:
-            self.res = [r for r in self.coll() if r.id == res][0]
-            return
-        except IndexError:
-            pass
+            # name of existing resource. gets most recent.
+            self.res = self.find(res)
+            if self.res:
+                self._loaded = time()
+                return
 
         # name of new resource to be created
         if not isinstance(res, str):
@@ -48,9 +64,23 @@ class Resource:
             )
 
     def __getattr__(self, attr):
-        """ pass undefined calls to embedded aws resource """
+        """ pass undefined calls to embedded aws resource
+
+        values are cached for ttl seconds. methods invalidate the cache as they may change the resource.
+        """
         self.refresh()
-        return self.res.__getattribute__(attr)
+        value = self.res.__getattribute__(attr)
+        if not callable(value):
+            return value
+
+        @wraps(value)
+        def action(*args, **kwargs):
+            try:
+                return value(*args, **kwargs)
+            finally:
+                self.invalidate()
+
+        return action
 
     def __repr__(self):
         """ unique name """
@@ -59,9 +89,39 @@ class Resource:
         except:
             return self.name
 
+    def find(self, name):
+        """ get most recent aws resource with name. uses names index if fresh else lists by name.
+        :return: aws resource or None if not found
+        """
+        key = (self.idprefix, name)
+        try:
+            id, created = names[key]
+            if time() - created < NAME_TTL:
+                res = aws.get_byid(id)
+                tags = {tag["Key"]: tag["Value"] for tag in (res.tags or [])} if res else {}
+                if tags.get("Name") == name:
+                    return res
+        except KeyError:
+            pass
+
+        try:
+            res = self.coll(Name=name, latest=1)[-1]
+        except IndexError:
+            names.pop(key, None)
+            return None
+        names[key] = (res.id, time())
+        return res
+
     def refresh(self):
-        """ ensure any values retrieved come from live resource. boto3 resources do not reflect live changes """
-        self.res = self.res.__class__(self.res.id)
+        """ ensure any values retrieved are no older than ttl. boto3 resources do not reflect live changes """
+        if time() - self._loaded < self.ttl:
+            return
+        self.res = self.res.__class__(self.res.id, client=self.res.meta.client)
+        self._loaded = time()
+
+    def invalidate(self):
+        """ next value retrieved comes from live resource """
+        self._loaded = 0
 
     @property
     def name(self):
@@ -82,4 +142,7 @@ class Resource:
 
     def set_tags(self, **kwargs):
         """ e.g. set tags using key=value e.g. set_tags(name="fred", region="Europe") """
-        self.create_tags(Tags=[dict(Key=k, Value=str(v)) for k, v in kwargs.items()])
+        self.res.create_tags(Tags=[dict(Key=k, Value=str(v)) for k, v in kwargs.items()])
+        self.invalidate()
+        if kwargs.get("Name"):
+            names[(self.idprefix, str(kwargs["Name"]))] = (self.id, time())
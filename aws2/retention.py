@@ -0,0 +1,153 @@
+"""
+retention of images and snapshots with the same name
+    plan decides which to keep and which to delete. use as a dry run report.
+    apply deletes concurrently and retries when aws throttles requests
+
+NOTE: snapshots used by an image that is kept are never deleted
+"""
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from time import sleep
+
+import pandas as pd
+
+from . import aws
+from .trace import THROTTLED
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class Policy:
+    """ what to keep for each name
+
+    :param images: number of most recent images kept
+    :param snapshots: number of most recent unused snapshots kept. None keeps all.
+    :param days: unused snapshots older than days are deleted. None keeps all.
+    :param replaced: True deletes unused snapshots of images that are deleted. used when an image is saved.
+    :param orphans: True deletes all unused snapshots including backups never used by an image
+
+    unused snapshots are named snapshots not used by any image that is kept
+    """
+
+    images: int = 1
+    snapshots: int = None
+    days: float = None
+    replaced: bool = False
+    orphans: bool = False
+
+
+def plan(names=None, policy=None):
+    """ return dataframe of images and snapshots with action keep or delete
+
+    :param names: list of names. default all named images and snapshots.
+    :param policy: Policy. default keeps the latest image and all snapshots.
+    :return: dataframe with columns type, id, name, created, action, reason
+    """
+    policy = policy or Policy()
+
+    # images
+    df = aws.describe(
+        "describe_images",
+        "Images",
+        ["ImageId", "CreationDate", "BlockDeviceMappings"],
+        Owners=["self"],
+    )
+    tags = aws.get_tagsdf(df.Tags)
+    images = pd.DataFrame(
+        dict(
+            type="image",
+            id=df.ImageId,
+            name=(tags["Name"] if "Name" in tags else pd.Series(dtype=object)).reindex(df.index),
+            created=pd.to_datetime(df.CreationDate, utc=True),
+        )
+    )
+    # rank 0 is the latest for each name
+    rank = images.groupby("name").created.rank(ascending=False, method="first") - 1
+    images["action"] = "keep"
+    images["reason"] = ""
+    old = images.name.notnull() & (rank >= policy.images)
+    images.loc[old, ["action", "reason"]] = ["delete", f"not latest {policy.images}"]
+
+    # snapshots used by images that are kept. includes images with other names.
+    def snapshotids(action):
+        return {
+            bdm["Ebs"]["SnapshotId"]
+            for bdms in df.BlockDeviceMappings[images.action == action]
+            for bdm in bdms
+            if "SnapshotId" in bdm.get("Ebs", {})
+        }
+
+    used = snapshotids("keep")
+    replaced = snapshotids("delete")
+
+    # snapshots
+    df = aws.get_snapshotsdf() if names is None else aws.get_snapshotsdf(name=list(names))
+    snapshots = pd.DataFrame(
+        dict(type="snapshot", id=df.snapshot_id, name=df.name.where(df.name != ""), created=df.created)
+    )
+    snapshots["action"] = "keep"
+    snapshots["reason"] = ""
+    free = snapshots.name.notnull() & ~snapshots.id.isin(used)
+    if policy.snapshots is not None:
+        rank = snapshots.groupby("name").created.rank(ascending=False, method="first") - 1
+        old = free & (rank >= policy.snapshots)
+        snapshots.loc[old, ["action", "reason"]] = ["delete", f"not latest {policy.snapshots}"]
+    if policy.days is not None:
+        age = pd.Timestamp.now(tz="UTC") - snapshots.created
+        old = free & (age > pd.Timedelta(days=policy.days))
+        snapshots.loc[old, ["action", "reason"]] = ["delete", f"older than {policy.days} days"]
+    if policy.replaced:
+        old = free & snapshots.id.isin(replaced)
+        snapshots.loc[old, ["action", "reason"]] = ["delete", "image deleted"]
+    if policy.orphans:
+        snapshots.loc[free, ["action", "reason"]] = ["delete", "not used by an image"]
+
+    report = pd.concat([images, snapshots], ignore_index=True)
+    report = report[report.name.notnull()]
+    if names is not None:
+        report = report[report.name.isin(names)]
+    return report.sort_values(["name", "type", "created"], ignore_index=True)
+
+
+def apply(report, max_workers=8):
+    """ delete images then snapshots marked delete in report. concurrent with retries if throttled.
+
+    :param report: dataframe from plan
+    :return: list of ids deleted
+    """
+    delete = report[report.action == "delete"]
+    images = delete.id[delete.type == "image"].tolist()
+    snapshots = delete.id[delete.type == "snapshot"].tolist()
+    c = aws.client
+    deleted = []
+    with ThreadPoolExecutor(max_workers) as executor:
+        # images first as snapshots used by an image cannot be deleted
+        for ids, func, key in [
+            (images, c.deregister_image, "ImageId"),
+            (snapshots, c.delete_snapshot, "SnapshotId"),
+        ]:
+            futures = {id: executor.submit(retry, func, **{key: id}) for id in ids}
+            for id, f in futures.items():
+                try:
+                    f.result()
+                    deleted.append(id)
+                except Exception as e:
+                    log.warning(f"cannot delete {id}. {e}")
+    log.info(f"deleted {len(deleted)} of {len(images)} images and {len(snapshots)} snapshots")
+    return deleted
+
+
+def retry(func, attempts=8, **kwargs):
+    """ call aws func. exponential backoff with jitter if throttled. """
+    from botocore.exceptions import ClientError
+
+    for attempt in range(attempts):
+        try:
+            return func(**kwargs)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in THROTTLED or attempt == attempts - 1:
+                raise
+            sleep(random.uniform(0, 2 ** attempt))
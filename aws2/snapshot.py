@@ -8,16 +8,20 @@ log = logging.getLogger(__name__)
 class Snapshot(Resource):
     """ an AWS snapshot resource """
 
+    idprefix = "snap-"
+
     def __init__(self, res):
         self.coll = aws.get_snapshots
         super().__init__(res)
 
-    def register_image(self, name=None):
+    def register_image(self, name=None, ena=False, **kwargs):
         """ blocking save
         
         :param name: saved image name
+        :param ena: enable enhanced networking. required for some instance types e.g. c5.
+        :param kwargs: override aws register_image args e.g. Architecture, BlockDeviceMappings, RootDeviceName
         """
-        from . import Image
+        from . import Image, retention
 
         if not name:
             name = self.name
@@ -27,13 +31,16 @@ class Snapshot(Resource):
             DeviceName="/dev/xvda",
             Ebs=dict(DeleteOnTermination=False, SnapshotId=self.id, VolumeType="gp2"),
         )
-        imageid = aws.client.register_image(
+        spec = dict(
             Architecture="x86_64",
-            Name=str(uuid.uuid4()),
             BlockDeviceMappings=[bdm],
             RootDeviceName="/dev/xvda",
             VirtualizationType="hvm",
-        )["ImageId"]
+        )
+        spec.update(kwargs)
+        if ena:
+            spec.update(EnaSupport=True, SriovNetSupport="simple")
+        imageid = aws.client.register_image(Name=str(uuid.uuid4()), **spec)["ImageId"]
         image = Image(aws.ec2.Image(imageid))
 
         # wait for save complete
@@ -42,10 +49,8 @@ class Snapshot(Resource):
         waiter.wait(ImageIds=[image.id])
         image.name = name
 
-        # deregister all except latest
-        images = aws.get_images(name=name)
-        for image in images[:-1]:
-            aws.client.deregister_image(ImageId=image.id)
+        # deregister all except latest and delete their snapshots
+        retention.apply(retention.plan([name], retention.Policy(replaced=True)))
 
     ####### rarely used. NOT FULLY TESTED #####################################
 
@@ -54,7 +59,7 @@ class Snapshot(Resource):
         from . import Volume
 
         if isinstance(instance, str):
-            instance = aws.get_instances(name=instance)[-1]
+            instance = aws.get_instances(name=instance, latest=1)[-1]
 
         r = aws.client.create_volume(
             SnapshotId=self.id,
@@ -1,7 +1,6 @@
 import logging
-from time import sleep
-import threading
-from . import aws, Instance
+from concurrent.futures import ThreadPoolExecutor
+from . import aws, hosts, jobs, ports, spotwatch, Instance
 
 log = logging.getLogger(__name__)
 
@@ -9,13 +8,13 @@ log = logging.getLogger(__name__)
 class Spot(Instance):
     """
     spot instance is saved as a snapshot/image with same name
-    multiple versions of images/snapshots with the same name represent different versions. delete to rollback.
+    previous image and its snapshot are deleted on save. other snapshots with the same name are kept e.g. backups.
     instance name is unique and reset on termination. otherwise there would be a conflict saving snapshots and images
     
     # todo review spot versus instance. could be thinner instance?
     """
-    def get_spec(self, name, instance_type, specfile):
-        spec = super().get_spec(name, instance_type, specfile)
+    def get_spec(self, name, instance_type, specfile, **constraints):
+        spec = super().get_spec(name, instance_type, specfile, **constraints)
         spec.pop("MinCount", "")
         spec.pop("MaxCount", "")
         return spec
@@ -25,92 +24,140 @@ class Spot(Instance):
         :param spec: dict definition of instance
         :return: running aws.ec2.Instance
         """
-        log.info("requesting spot")
-        r = aws.client.request_spot_instances(LaunchSpecification=spec)
-        requestId = r["SpotInstanceRequests"][0]["SpotInstanceRequestId"]
-        try:
-            waiter = aws.client.get_waiter("spot_instance_request_fulfilled")
-            waiter.wait(SpotInstanceRequestIds=[requestId])
-        except KeyboardInterrupt:
-            log.warning("cancelling request")
-            aws.client.cancel_spot_instance_requests(SpotInstanceRequestIds=[requestId])
+        launched = self.request(spec)
+        if launched is None:
             return
-        except Exception:
-            raise Exception("problem launching spot instance")
-        instanceId = aws.client.describe_spot_instance_requests(
-            SpotInstanceRequestIds=[requestId]
-        )["SpotInstanceRequests"][0]["InstanceId"]
-        res = aws.ec2.Instance(instanceId)
-        log.info("wait until running")
-        res.wait_until_running()
-
-        # spot termination thread
-        p = threading.Thread(target=self.spotcheck, args=[requestId, self.stop])
-        p.start()
+        requestId, res = launched[0]
+
+        spotwatch.register(requestId, self.stop)
 
         return res
 
-    def spotcheck(self, requestId, callback):
-        """ poll for spot request termination notice
+    @staticmethod
+    def request(spec, count=1):
+        """ request spot instances with one request and wait until all running
+        :param spec: dict definition of instance
+        :param count: number of instances
+        :return: list of (spot request id, running aws.ec2.Instance). None if cancelled.
 
-        :param requestId: spot request to poll
-        :param callback: callback function when notice received
+        if any request fails then all are cancelled and instances already launched are terminated
+        """
+        log.info(f"requesting {count} spot")
+        r = aws.client.request_spot_instances(InstanceCount=count, LaunchSpecification=spec)
+        requestIds = [x["SpotInstanceRequestId"] for x in r["SpotInstanceRequests"]]
+        try:
+            waiter = aws.client.get_waiter("spot_instance_request_fulfilled")
+            waiter.wait(SpotInstanceRequestIds=requestIds)
+            requests = aws.client.describe_spot_instance_requests(
+                SpotInstanceRequestIds=requestIds
+            )["SpotInstanceRequests"]
+            instanceIds = [r["InstanceId"] for r in requests]
+            log.info("wait until running")
+            waiter = aws.client.get_waiter("instance_running")
+            waiter.wait(InstanceIds=instanceIds)
+        except KeyboardInterrupt:
+            Spot.cancel(requestIds)
+            return
+        except Exception as e:
+            Spot.cancel(requestIds)
+            raise Exception("problem launching spot instance") from e
+        return [(r["SpotInstanceRequestId"], aws.ec2.Instance(r["InstanceId"])) for r in requests]
+
+    @staticmethod
+    def cancel(requestIds):
+        """ cancel spot requests and terminate instances already launched for them """
+        log.warning("cancelling request")
+        aws.client.cancel_spot_instance_requests(SpotInstanceRequestIds=requestIds)
+        requests = aws.client.describe_spot_instance_requests(
+            SpotInstanceRequestIds=requestIds
+        )["SpotInstanceRequests"]
+        instanceIds = [r["InstanceId"] for r in requests if r.get("InstanceId")]
+        if instanceIds:
+            log.warning(f"terminating {len(instanceIds)} instances launched")
+            aws.client.terminate_instances(InstanceIds=instanceIds)
+
+    @classmethod
+    def fleet(cls, name, count, instance_type=None, specfile=None, user="ubuntu", prefix=None, **constraints):
+        """ launch new spot instances with one request and set them up in parallel
+
+        :param name: image name. instances are named f"{name}-0", f"{name}-1" etc.
+        :param count: number of instances
+        :param instance_type: overrides the instance type in spec. "auto" selects the cheapest that fits constraints.
+        :param specfile: optional aws instance specification. if None then f"{name}.yaml" or default.yaml
+        :param user: username for ssh connection
+        :param prefix: instances are named f"{prefix}-0" etc. default is name.
+        :param constraints: passed to aws.select_instancetypes if instance_type="auto"
+        :return: list of Spot that are set up. instances that fail are terminated.
         """
-        while True:
-            try:
-                requests = aws.client.describe_spot_instance_requests(
-                    SpotInstanceRequestIds=[requestId]
-                )
-                request = requests["SpotInstanceRequests"][0]
-            except:
-                # spot request not found. instance probably terminated.
-                # keep going just in case. if already terminated then costs nothing!
-                pass
-
-            # instance marked for termination
-            if request["Status"]["Code"] == "marked-for-termination":
-                log.warning(
-                    "spot request marked for termination by amazon. "
-                    "attempting to save volume as snapshot"
-                )
-
-                log.info(f"terminating {self.name}")
-                callback(self)
-                return
-
-            # instance terminated in some other way
-            if request["Status"]["Code"] not in [
-                "fulfilled",
-                "instance-terminated-by-user",
-            ]:
-                log.info("spot status is %s" % request["Status"]["Code"])
-                return
-
-            # amazon recommend poll every 5 seconds
-            sleep(5)
-
-    def terminate(self, save=True, ena=False):
-        """ terminate instance and save as snapshot/image. block until saved.
-        :param ena: True sets ena. time consuming as uses hack below.
-
-        sometimes want to use cheap spot for setup then switch to ena
-        ena cannot be turned on from a running instance and spot instances cannot be stopped.
-        hack is to save spot; create new instance; stop it; set ena; save it.
+        prefix = prefix or name
+        spec = cls.__new__(cls).get_spec(name, instance_type, specfile, **constraints)
+        launched = cls.request(spec, count)
+        if launched is None:
+            return []
+        try:
+            ports.wait([(res.public_ip_address, 22) for _, res in launched])
+        except BaseException:
+            cls.cancel([requestId for requestId, _ in launched])
+            raise
+
+        def setup(i, requestId, res):
+            spot = cls.__new__(cls)
+            spot.coll = aws.get_instances
+            spot.res = res
+            spot.name = f"{prefix}-{i}"
+            spot.user = user
+            spot.post_launch(register=False)
+            spotwatch.register(requestId, spot.stop)
+            return spot
+
+        spots = []
+        with ThreadPoolExecutor(count) as executor:
+            futures = [executor.submit(setup, i, *x) for i, x in enumerate(launched)]
+            for (requestId, res), f in zip(launched, futures):
+                try:
+                    spots.append(f.result())
+                except Exception:
+                    log.exception(f"setup failed on {res.id}")
+                    cls.cancel([requestId])
+        # one write for the whole fleet
+        hosts.register(spots)
+        return spots
+
+    def terminate(self, save=True, ena=False, wait=False):
+        """ terminate instance and save as snapshot/image in the background
+        :param ena: register image with ena e.g. use cheap spot for setup then launch c5 from image
+        :param wait: block until saved
+        :return: Job that saves. job.timings has the time for each phase.
         """
-        from . import Image
-
         volume = self.volumes[0]
         name = self.name
+        spotwatch.unregister(self.spot_instance_request_id)
         super().terminate()
+        job = jobs.Job(self.save, (volume, save, ena), name=f"save {name}")
+        if wait:
+            job.result()
+        return job
+
+    @staticmethod
+    def save(volume, save=True, ena=False):
+        """ save detached volume as snapshot/image and delete volume """
+        # snapshot as soon as volume is detached
+        with jobs.phase("detach"):
+            waiter = aws.client.get_waiter("volume_available")
+            waiter.wait(VolumeIds=[volume.id])
         if save:
-            volume.create_image()
-        volume.delete()
-
-        # start a new instance to set ena. hack required as volume.create_image never sets ena.
-        if ena:
-            i = Image(name)
-            i.set_ena()
-
-    def stop(self, save=True):
+            with jobs.phase("snapshot"):
+                snapshot = volume.create_snapshot()
+            # register image while volume is deleted
+            with jobs.phase("image"):
+                with ThreadPoolExecutor(1) as executor:
+                    deleted = executor.submit(volume.delete)
+                    snapshot.register_image(ena=ena)
+                    deleted.result()
+        else:
+            with jobs.phase("delete"):
+                volume.delete()
+
+    def stop(self, save=True, ena=False):
         """ for spot instance this is same as terminate """
-        self.terminate(save=save)
+        return self.terminate(save=save, ena=ena)
@@ -0,0 +1,108 @@
+"""
+local store of spot price history
+    sync incrementally from aws
+    price statistics per instance type and availability zone
+"""
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from . import aws, store
+
+log = logging.getLogger(__name__)
+
+TABLE = "spothistory"
+
+
+@contextmanager
+def connect():
+    """ connection to local store with spothistory table """
+    with store.connect() as con:
+        con.execute(
+            f"create table if not exists {TABLE} ("
+            "availability_zone text, instance_type text, timestamp real, spot_price real, "
+            "primary key (availability_zone, instance_type, timestamp))"
+        )
+        yield con
+
+
+def sync(days=7):
+    """ fetch spot prices since the last stored timestamp
+
+    :param days: history fetched on first sync. aws keeps 90 days.
+    :return: number of new prices stored
+    """
+    with connect() as con:
+        last = con.execute(f"select max(timestamp) from {TABLE}").fetchone()[0]
+    if last:
+        start = datetime.fromtimestamp(last, timezone.utc)
+    else:
+        start = datetime.now(timezone.utc) - timedelta(days=days)
+
+    log.info(f"fetching spot prices since {start}")
+    pager = aws.client.get_paginator("describe_spot_price_history").paginate(
+        StartTime=start, ProductDescriptions=["Linux/UNIX"]
+    )
+    added = 0
+    for page in pager:
+        rows = [
+            (
+                p["AvailabilityZone"],
+                p["InstanceType"],
+                p["Timestamp"].timestamp(),
+                float(p["SpotPrice"]),
+            )
+            for p in page["SpotPriceHistory"]
+        ]
+        # commit each page so the store is not locked while the next page downloads
+        with connect() as con:
+            before = con.total_changes
+            con.executemany(f"insert or ignore into {TABLE} values (?, ?, ?, ?)", rows)
+            added += con.total_changes - before
+    store.set_meta(TABLE)
+    log.info(f"{added} new spot prices")
+    return added
+
+
+def get_history(days=7, instance_types=None, zones=None):
+    """ return dataframe of stored spot prices
+
+    :param days: window ending now
+    :param instance_types: optional list of instance types
+    :param zones: optional list of availability zones
+    """
+    start = (datetime.now(timezone.utc) - timedelta(days=days)).timestamp()
+    with connect() as con:
+        df = pd.read_sql(
+            f"select * from {TABLE} where timestamp >= ?", con, params=[start]
+        )
+    if instance_types:
+        df = df[df.instance_type.isin(instance_types)]
+    if zones:
+        df = df[df.availability_zone.isin(zones)]
+    df["timestamp"] = pd.to_datetime(df.timestamp, unit="s", utc=True)
+    # empty result is object dtype
+    df["spot_price"] = df.spot_price.astype(float)
+    return df
+
+
+def get_stats(days=7, by=("instance_type", "availability_zone"), percentiles=(0.1, 0.5, 0.9), **filters):
+    """ return dataframe of spot price statistics from the local store
+
+    :param days: window ending now
+    :param by: columns to group
+    :param percentiles: quantiles returned as columns p10, p50 etc.
+    :param filters: instance_types, zones passed to get_history
+    :return: count, min, mean, max, std, percentiles and volatility (std/mean) per group
+    """
+    df = get_history(days, **filters)
+    prices = df.groupby(list(by)).spot_price
+    stats = prices.agg(["count", "min", "mean", "max", "std"])
+    # reindex as no columns if no prices
+    quantiles = prices.quantile(list(percentiles)).unstack().reindex(columns=list(percentiles))
+    quantiles.columns = [f"p{round(q * 100)}" for q in quantiles.columns]
+    stats = stats.join(quantiles)
+    stats["volatility"] = stats["std"] / stats["mean"]
+    return stats.sort_values("mean")
@@ -0,0 +1,139 @@
+"""
+single watcher for spot interruption of all spot instances
+    polls all registered spot requests with one call
+    optionally polls the instance metadata when running on a spot instance
+    calls the callback for an instance when aws marks it for termination
+"""
+import atexit
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# amazon recommend poll every 5 seconds
+POLL = 5
+# maximum values for a describe filter
+BATCH = 100
+METADATA = "http://169.254.169.254/latest"
+
+# spot request id => callback
+callbacks = dict()
+# callback when metadata of this machine has termination notice
+local = None
+lock = threading.Lock()
+stopping = threading.Event()
+watcher = None
+
+
+def register(requestId, callback):
+    """ call callback() when spot request is marked for termination """
+    with lock:
+        callbacks[requestId] = callback
+    start()
+
+
+def unregister(requestId):
+    """ stop watching spot request """
+    with lock:
+        callbacks.pop(requestId, None)
+
+
+def register_local(callback):
+    """ call callback() when instance metadata of this machine has a termination notice """
+    global local
+    local = callback
+    start()
+
+
+def start():
+    """ start watcher thread if not running """
+    global watcher
+    with lock:
+        if watcher and watcher.is_alive():
+            return
+        stopping.clear()
+        watcher = threading.Thread(target=watch, name="spotwatch", daemon=True)
+        watcher.start()
+
+
+def shutdown(timeout=None):
+    """ stop watcher thread. callbacks already running are not affected """
+    stopping.set()
+    if watcher:
+        watcher.join(timeout)
+
+
+atexit.register(shutdown)
+
+
+def watch():
+    """ poll until shutdown """
+    while not stopping.is_set():
+        try:
+            poll()
+        except Exception:
+            log.exception("spot watcher poll failed")
+        stopping.wait(POLL)
+
+
+def poll():
+    """ check all registered spot requests and the local metadata once """
+    from . import aws
+
+    global local
+    with lock:
+        requestIds = list(callbacks)
+    for i in range(0, len(requestIds), BATCH):
+        # filter rather than SpotInstanceRequestIds as that fails if any request not found
+        requests = aws.client.describe_spot_instance_requests(
+            Filters=aws.filt(spot_instance_request_id=requestIds[i : i + BATCH])
+        )["SpotInstanceRequests"]
+        for request in requests:
+            code = request["Status"]["Code"]
+            if code == "fulfilled":
+                continue
+            with lock:
+                callback = callbacks.pop(request["SpotInstanceRequestId"], None)
+            if callback is None:
+                continue
+            if code == "marked-for-termination":
+                log.warning(
+                    f"spot request {request['SpotInstanceRequestId']} marked for termination by amazon. "
+                    "attempting to save volume as snapshot"
+                )
+                dispatch(callback)
+            else:
+                # instance terminated in some other way
+                log.info(f"spot status is {code}")
+
+    if local and termination_notice():
+        log.warning("termination notice in instance metadata")
+        callback, local = local, None
+        dispatch(callback)
+
+
+def dispatch(callback):
+    """ run callback in its own thread. not daemon so that saves complete before exit """
+    threading.Thread(target=callback).start()
+
+
+def termination_notice():
+    """ return True if instance metadata of this machine has a spot termination notice """
+    import requests
+
+    try:
+        headers = dict()
+        try:
+            r = requests.put(
+                f"{METADATA}/api/token",
+                headers={"X-aws-ec2-metadata-token-ttl-seconds": "60"},
+                timeout=1,
+            )
+            if r.ok:
+                headers["X-aws-ec2-metadata-token"] = r.text
+        except requests.RequestException:
+            pass
+        r = requests.get(f"{METADATA}/meta-data/spot/instance-action", headers=headers, timeout=1)
+    except requests.RequestException:
+        return False
+    return r.status_code == 200
@@ -0,0 +1,105 @@
+"""
+process wide pool of ssh connections
+    one fabric Connection per (host, user) shared by all Instance objects
+    each run/sudo opens a new channel on the shared transport rather than a new connection
+    keepalive so that open connections are not dropped
+    connections unused for IDLE seconds are closed
+"""
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from os.path import expanduser, join
+from time import time
+
+log = logging.getLogger(__name__)
+
+KEY = join(expanduser("~"), ".aws/key")
+KEEPALIVE = 30
+IDLE = 600
+
+# (host, user) => connection
+pool = dict()
+# (host, user) => lock for opening the connection
+locks = dict()
+# (host, user) => time last used
+used = dict()
+# (host, user) => number of commands running
+busy = dict()
+lock = threading.Lock()
+
+
+def get(host, user, key_filename=KEY):
+    """ return open connection from pool. connects if not already connected """
+    from fabric import Connection
+
+    evict()
+    key = (host, user)
+    with lock:
+        c = pool.get(key)
+        if c is None:
+            c = Connection(host, user=user, connect_kwargs=dict(key_filename=key_filename))
+            pool[key] = c
+            locks[key] = threading.Lock()
+        used[key] = time()
+        keylock = locks[key]
+
+    # other hosts can connect at the same time
+    with keylock:
+        if not c.is_connected:
+            c.open()
+            c.transport.set_keepalive(KEEPALIVE)
+    return c
+
+
+@contextmanager
+def using(host, user, key_filename=KEY):
+    """ connection from pool that is not evicted until the block exits """
+    key = (host, user)
+    c = get(host, user, key_filename)
+    with lock:
+        busy[key] = busy.get(key, 0) + 1
+    try:
+        yield c
+    finally:
+        with lock:
+            busy[key] -= 1
+            used[key] = time()
+
+
+def evict(idle=IDLE):
+    """ close connections unused for idle seconds """
+    with lock:
+        idlekeys = [
+            key for key, last in used.items() if time() - last > idle and not busy.get(key)
+        ]
+    for key in idlekeys:
+        close(*key, idle=idle)
+
+
+def close(host, user, idle=None):
+    """ close connection and remove from pool
+
+    :param idle: only close if still unused for idle seconds. checked under the lock as get may reuse it.
+    """
+    key = (host, user)
+    with lock:
+        if idle is not None:
+            if time() - used.get(key, time()) <= idle or busy.get(key):
+                return
+            log.info(f"closing idle connection {key}")
+        used.pop(key, None)
+        busy.pop(key, None)
+        locks.pop(key, None)
+        c = pool.pop(key, None)
+    if c:
+        c.close()
+
+
+def closeall():
+    """ close all connections """
+    for key in list(pool):
+        close(*key)
+
+
+atexit.register(closeall)
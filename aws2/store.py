@@ -0,0 +1,63 @@
+"""
+local sqlite store for data that is slow to fetch from aws
+    tables of dataframes
+    meta table with time updated and version of each table
+"""
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+from os.path import dirname, expanduser, join
+from time import time
+
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+DB = join(expanduser("~"), ".aws2", "aws2.sqlite")
+
+
+@contextmanager
+def connect():
+    """ connection to local store. creates if not exists. commits and closes when the block exits. """
+    os.makedirs(dirname(DB), exist_ok=True)
+    con = sqlite3.connect(DB, timeout=60)
+    try:
+        with con:
+            con.execute(
+                "create table if not exists meta (name text primary key, updated real, version text)"
+            )
+            yield con
+    finally:
+        con.close()
+
+
+def read(table):
+    """ return dataframe or None if table not in store """
+    with connect() as con:
+        exists = con.execute(
+            "select 1 from sqlite_master where type='table' and name=?", [table]
+        ).fetchone()
+        if not exists:
+            return None
+        return pd.read_sql(f'select * from "{table}"', con)
+
+
+def write(df, table, version=None):
+    """ replace table and record time updated and version """
+    with connect() as con:
+        df.to_sql(table, con, if_exists="replace", index=False)
+    set_meta(table, version)
+
+
+def get_meta(table):
+    """ return (updated, version) for table. updated is 0 if never written """
+    with connect() as con:
+        r = con.execute("select updated, version from meta where name=?", [table]).fetchone()
+    return r or (0, None)
+
+
+def set_meta(table, version=None):
+    """ mark table as updated now """
+    with connect() as con:
+        con.execute("replace into meta values (?, ?, ?)", [table, time(), version])
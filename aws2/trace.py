@@ -0,0 +1,142 @@
+"""
+trace aws api calls using botocore event hooks
+    hooks are registered on each session so every client created by aws.get_client is traced
+    records service, operation, calling aws2 function, latency, retries and throttled attempts
+    nothing is recorded unless a tracing block is active
+
+e.g. count calls made by a launch::
+
+    with trace.tracing() as calls:
+        Spot("myimage")
+    trace.summary(calls)
+"""
+import logging
+import sys
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+log = logging.getLogger(__name__)
+
+THROTTLED = ["RequestLimitExceeded", "Throttling", "ThrottlingException"]
+
+# lists of calls for each active tracing block
+traces = []
+lock = threading.Lock()
+
+
+def register(events):
+    """ add trace hooks to a botocore event emitter e.g. session.events """
+    # wildcards so that hooks run before handlers that short circuit calls e.g. Stubber
+    events.register("before-call.*.*", before_call)
+    events.register("needs-retry.*.*", needs_retry)
+    events.register("after-call.*.*", after_call)
+    events.register("after-call-error.*.*", after_call_error)
+
+
+@contextmanager
+def tracing():
+    """ record aws calls made in the block by any thread
+
+    :return: list of calls that fills as calls complete. each call is a dict.
+    """
+    calls = []
+    with lock:
+        traces.append(calls)
+    try:
+        yield calls
+    finally:
+        with lock:
+            traces.remove(calls)
+
+
+def summary(calls, by=("operation", "caller")):
+    """ return dataframe of calls grouped by columns
+
+    :param calls: list from tracing
+    :param by: columns to group e.g. service, operation, caller
+    :return: calls, total/mean/max latency seconds, retries, throttled and errors per group sorted by calls
+    """
+    import pandas as pd
+
+    columns = ["service", "operation", "caller", "latency", "retries", "throttled", "error"]
+    df = pd.DataFrame(calls, columns=columns)
+    return (
+        df.groupby(list(by))
+        .agg(
+            calls=("latency", "count"),
+            latency=("latency", "sum"),
+            mean=("latency", "mean"),
+            max=("latency", "max"),
+            retries=("retries", "sum"),
+            throttled=("throttled", "sum"),
+            errors=("error", "count"),
+        )
+        .sort_values("calls", ascending=False)
+    )
+
+
+def caller():
+    """ return innermost aws2 function on the stack outside this module e.g. resource.Resource.refresh """
+    frame = sys._getframe(1)
+    while frame:
+        module = frame.f_globals.get("__name__", "")
+        code = frame.f_code
+        # skip comprehensions e.g. <listcomp>
+        if module.startswith(f"{__package__}.") and module != __name__ and not code.co_name.startswith("<"):
+            return f"{module[len(__package__) + 1:]}.{getattr(code, 'co_qualname', code.co_name)}"
+        frame = frame.f_back
+    return ""
+
+
+# botocore hooks. context is a dict shared by all events for one call ############################
+
+
+def before_call(model, context, **kwargs):
+    if not traces:
+        return
+    context["aws2trace"] = dict(
+        service=model.service_model.service_name,
+        operation=model.name,
+        caller=caller(),
+        start=perf_counter(),
+        throttled=0,
+    )
+
+
+def needs_retry(response, request_dict, **kwargs):
+    call = request_dict.get("context", {}).get("aws2trace")
+    if call is None or response is None:
+        return
+    if response[1].get("Error", {}).get("Code") in THROTTLED:
+        call["throttled"] += 1
+
+
+def after_call(parsed, context, **kwargs):
+    call = context.pop("aws2trace", None)
+    if call is None:
+        return
+    end(call, parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0), parsed.get("Error", {}).get("Code"))
+
+
+def after_call_error(exception, context, **kwargs):
+    call = context.pop("aws2trace", None)
+    if call is None:
+        return
+    end(call, 0, type(exception).__name__)
+
+
+def end(call, retries, error):
+    """ add completed call to active traces """
+    call = dict(
+        service=call["service"],
+        operation=call["operation"],
+        caller=call["caller"],
+        latency=perf_counter() - call["start"],
+        retries=retries,
+        throttled=call["throttled"],
+        error=error,
+    )
+    with lock:
+        for calls in traces:
+            calls.append(call)
@@ -1,4 +1,5 @@
 import logging
+from time import sleep
 from . import aws, Resource
 
 log = logging.getLogger(__name__)
@@ -7,42 +8,34 @@ log = logging.getLogger(__name__)
 class Volume(Resource):
     """ an AWS volume resource """
 
+    idprefix = "vol-"
+
     def __init__(self, res):
         self.coll = aws.get_volumes
         super().__init__(res)
 
     def create_snapshot(self, name=None):
         """ blocking save """
-        from . import Snapshot
-
         if name is None:
             name = self.name
-
-        # create
-        log.info(f"saving snapshot")
-        snapshot = Snapshot(self.res.create_snapshot())
-        waiter = aws.client.get_waiter("snapshot_completed")
-        waiter.config.max_attempts = 99999
-        waiter.wait(SnapshotIds=[snapshot.id])
-
-        # name the snapshot and count
-        snapshot.name = name
-        snapcount = len(aws.get_snapshots(name=name))
-        log.info(f"You now have {snapcount} {name} snapshots")
-        return snapshot
+        return create_snapshots([self], [name])[0]
 
     def delete(self):
         """ release name and delete """
         waiter = aws.client.get_waiter("volume_available")
         waiter.wait(VolumeIds=[self.id])
         self.res.delete()
+        self.invalidate()
+
+    def create_image(self, name=None, ena=False):
+        """ save as snapshot and create image
 
-    def create_image(self, name=None):
-        """ save as snapshot and create image """
+        :param ena: enable enhanced networking on image
+        """
         if name is None:
             name = self.name
         snapshot = self.create_snapshot(name)
-        snapshot.register_image(name)
+        snapshot.register_image(name, ena=ena)
 
     ####### rarely used. NOT FULLY TESTED #####################################
 
@@ -108,3 +101,54 @@ class Volume(Resource):
     #     waiter = aws.client.get_waiter("volume_available")
     #     log.info(f"waiting for volume available")
     #     waiter.wait(VolumeIds=[self.id])
+
+
+def create_snapshots(volumes, names=None, poll=15, callback=None):
+    """ blocking save of many volumes. snapshots run at the same time and are polled together.
+
+    :param volumes: list of Volume
+    :param names: list of snapshot names. default is volume names.
+    :param poll: seconds between progress checks
+    :param callback: optional callback(snapshot, progress) when progress of a snapshot changes
+    :return: list of Snapshot in same order as volumes
+    """
+    from . import Snapshot
+
+    if names is None:
+        names = [v.name for v in volumes]
+
+    # create
+    log.info(f"saving {len(volumes)} snapshots")
+    snapshots = [Snapshot(v.res.create_snapshot()) for v in volumes]
+
+    # one describe call per poll per 100 snapshots. filter as new snapshots may not be found yet.
+    pending = {s.id: (s, name) for s, name in zip(snapshots, names)}
+    progress = dict()
+    failed = []
+    while pending:
+        ids = list(pending)
+        found = []
+        for i in range(0, len(ids), 100):
+            r = aws.client.describe_snapshots(Filters=aws.filt(snapshot_id=ids[i : i + 100]))
+            found.extend(r["Snapshots"])
+        for data in found:
+            snapshot, name = pending[data["SnapshotId"]]
+            if progress.get(snapshot.id) != data.get("Progress"):
+                progress[snapshot.id] = data.get("Progress")
+                log.info(f"snapshot {name} ({snapshot.id}) {data.get('Progress', '0%')}")
+                if callback:
+                    callback(snapshot, data.get("Progress"))
+            if data["State"] == "completed":
+                # name the snapshot
+                del pending[snapshot.id]
+                snapshot.name = name
+            elif data["State"] == "error":
+                del pending[snapshot.id]
+                failed.append(snapshot.id)
+        if pending:
+            sleep(poll)
+    if failed:
+        raise Exception(f"snapshots failed {failed}")
+    log.info(f"saved {len(snapshots)} snapshots")
+    return snapshots
+